@@ -0,0 +1,383 @@
+# loadgen.py - GENERADOR DE CARGA PARA EL PIPELINE DE SEÑALES
+# Escribe filas realistas en un Sinal.csv de prueba y corre PolymarketTrader contra un CLOB falso local.
+# Uso: python loadgen.py --rate 1000 --duration 60
+
+import argparse
+import csv
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from uso import Config, LOG, LocalUserChannel, MarketResolver, PolymarketTrader
+
+HEADER = ["tempo", "ativo", "acao", "expiracao", "estrategia"]
+BTC_SYMBOLS = ["BTCUSD", "BTCUSDT", "btcusd"]
+OTHER_SYMBOLS = ["ETHUSD", "EURUSD", "XAUUSD"]
+USO_FILE = sys.modules[PolymarketTrader.__module__].__file__
+
+# ==================== CLOB FALSO ====================
+class FakeClob:
+    """
+    CLOB falso en proceso que registra cada orden
+    - Implementa los métodos de ClobClient que usa PolymarketTrader
+    - Sirve mercados 15m sintéticos por slug (reemplaza a Gamma)
+    - Publica cada trade en un LocalUserChannel para ejercitar el motor de posiciones
+    - La correlación orden → señal se hace con el log de eventos (campo signal de order_placed)
+    """
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000
+        self.orders = []          # (tiempo, token_id, monto, lado)
+        self.user_channel = None
+        self._seq = 0
+
+    def get_market_by_slug(self, slug):
+        epoch = int(slug[len(Config.SERIES_PATTERN):])
+        end = datetime.fromtimestamp(epoch + MarketResolver.INTERVAL_SEC, timezone.utc)
+        return {
+            'slug': slug,
+            'question': f"Bitcoin Up or Down - {epoch}",
+            'endDate': end.isoformat().replace('+00:00', 'Z'),
+            'clobTokenIds': json.dumps([f"{epoch}1", f"{epoch}2"]),
+            'outcomePrices': '["0.5","0.5"]',
+        }
+
+    def get_ok(self):
+        return "OK"
+
+    def get_balance_allowance(self, params):
+        return {'balance': str(10 ** 15)}
+
+    def get_midpoint(self, token_id):
+        return {'mid': "0.5"}
+
+    def get_spread(self, token_id):
+        return {'spread': "0.01"}
+
+    def create_market_order(self, args):
+        return args
+
+    def post_order(self, order, order_type):
+        if self.latency:
+            time.sleep(self.latency)
+        self._seq += 1
+        order_id = f"0xload{self._seq}"
+        self.orders.append((time.time(), order.token_id, order.amount, order.side))
+
+        price = 0.5
+        shares = order.amount / price
+        if self.user_channel:
+            self.user_channel.publish({
+                'event_type': 'trade',
+                'id': f"trade-{self._seq}",
+                'taker_order_id': order_id,
+                'asset_id': order.token_id,
+                'side': order.side,
+                'size': str(shares),
+                'price': str(price),
+                'status': 'MATCHED',
+            })
+        return {
+            'success': True,
+            'orderID': order_id,
+            'status': 'matched',
+            'makingAmount': str(order.amount),
+            'takingAmount': str(shares),
+        }
+
+# ==================== ESCRITOR DE SEÑALES ====================
+class SignalWriter:
+    """
+    Simula a MT4 escribiendo Sinal.csv
+    - Tasa base constante con ráfagas aleatorias
+    - Mezcla de símbolos BTC / no BTC, call / put y filas malformadas
+    - Rotación periódica del archivo (reemplazo atómico con solo encabezado), solo después de
+      que el lector leyó todo lo escrito; así las señales perdidas son del trader, no de la rotación
+    """
+    TICK_SEC = 0.01
+
+    def __init__(self, path, rate, duration, burst_prob, burst_size, malformed, other_symbols, rotate_every, seed):
+        self.path = path
+        self.rate = rate
+        self.duration = duration
+        self.burst_prob = burst_prob
+        self.burst_size = burst_size
+        self.malformed = malformed
+        self.other_symbols = other_symbols
+        self.rotate_every = rotate_every
+        self.rng = random.Random(seed)
+        self.written = {}         # seq -> momento de escritura (solo señales BTC válidas)
+        self.counts = {'rows': 0, 'valid': 0, 'malformed': 0, 'other_symbol': 0, 'rotations': 0,
+                       'rotations_deferred': 0, 'bursts': 0}
+        self.done = threading.Event()
+        self.read_upto = 0        # Filas escritas antes de empezar la última lectura completa
+        self._since_rotation = 0
+        self._seq = 0
+
+    def read(self, reader):
+        """Corre una lectura del trader y registra hasta qué fila quedó cubierta"""
+        upto = self.counts['rows']
+        reader()
+        self.read_upto = upto
+
+    def rotate(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', newline='') as f:
+            csv.writer(f).writerow(HEADER)
+        os.replace(tmp, self.path)
+        self._since_rotation = 0
+
+    def _row(self, ts):
+        self._seq += 1
+        strategy = f"lg-{self._seq}"
+        r = self.rng.random()
+        if r < self.malformed:
+            self.counts['malformed'] += 1
+            kind = self.rng.randrange(4)
+            if kind == 0:
+                return [str(ts), "BTCUSD", "call"], None                       # Columnas faltantes
+            if kind == 1:
+                return ["no-ts", "BTCUSD", "put", "15", strategy], None        # Timestamp inválido
+            if kind == 2:
+                return [str(ts), "BTCUSD", "hold", "15", strategy], None       # Acción inválida
+            return [str(ts), "BTCUSD", "call", "15", strategy, "extra"], None  # Columna extra
+        if r < self.malformed + self.other_symbols:
+            self.counts['other_symbol'] += 1
+            return [str(ts), self.rng.choice(OTHER_SYMBOLS), self.rng.choice(["call", "put"]), "15", strategy], None
+        self.counts['valid'] += 1
+        expiration = self.rng.choice(["5", "15", "15", "30"])
+        return [str(ts), self.rng.choice(BTC_SYMBOLS), self.rng.choice(["call", "put"]), expiration, strategy], strategy
+
+    def run(self):
+        self.rotate()
+        start = time.perf_counter()
+        last_second = -1
+        burst = 0
+        try:
+            while True:
+                elapsed = time.perf_counter() - start
+                if elapsed >= self.duration:
+                    break
+                due = int(self.rate * elapsed) - self.counts['rows']
+                second = int(elapsed)
+                if second != last_second:
+                    last_second = second
+                    if self.rng.random() < self.burst_prob:
+                        self.counts['bursts'] += 1
+                        burst += self.burst_size
+                due += burst
+                if due > 0 and self._write(due):
+                    burst = 0
+                time.sleep(self.TICK_SEC)
+        finally:
+            self.done.set()
+
+    def _write(self, n):
+        # Rota antes de agregar, y solo si el lector ya vio todas las filas del archivo actual;
+        # mientras tanto no agrega (las filas atrasadas salen juntas después de rotar)
+        if self.rotate_every and self._since_rotation >= self.rotate_every:
+            if self.read_upto < self.counts['rows']:
+                self.counts['rotations_deferred'] += 1
+                return False
+            self.counts['rotations'] += 1
+            self.rotate()
+        ts = int(time.time())
+        rows, seqs = [], []
+        for _ in range(n):
+            row, seq = self._row(ts)
+            rows.append(row)
+            if seq:
+                seqs.append(seq)
+        with open(self.path, 'a', newline='') as f:
+            csv.writer(f).writerows(rows)
+        now = time.time()
+        for seq in seqs:
+            self.written[seq] = now
+        self.counts['rows'] += n
+        self._since_rotation += n
+        return True
+
+# ==================== REPORTE ====================
+def uso_snapshot():
+    """Memoria viva asignada desde uso.py (tracemalloc); excluye las listas del propio harness"""
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, USO_FILE)])
+
+def memory_report(start, end):
+    """Memoria de uso.py al inicio y al final de la carga, y las líneas que más crecieron"""
+    def mb(snapshot):
+        return sum(stat.size for stat in snapshot.statistics('filename')) / (1024 * 1024)
+
+    top = end.compare_to(start, 'lineno')[:5]
+    return {
+        'start': round(mb(start), 1),
+        'end': round(mb(end), 1),
+        'growth': round(mb(end) - mb(start), 1),
+        'top_growth': [(f"uso.py:{stat.traceback[0].lineno}", round(stat.size_diff / 1024, 1)) for stat in top],
+    }
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def read_events(log):
+    """Lee el log de eventos completo, incluidos los archivos rotados, en orden"""
+    for name in log.backups() + [log.path]:
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+def build_report(writer, clob, trader, elapsed, memory):
+    # Correlación orden → señal desde el log: el campo signal es la fila de MT4 (estrategia = lg-<seq>)
+    ordered = {}
+    untracked = 0
+    for rec in read_events(LOG):
+        if rec['event'] != 'order_placed':
+            continue
+        signal = rec.get('signal')
+        if not signal:
+            untracked += 1
+            continue
+        ordered.setdefault(signal.rsplit(",", 1)[-1], []).append(rec['ts'])
+
+    lags = [(times[0] - writer.written[seq]) * 1000 for seq, times in ordered.items() if seq in writer.written]
+    per_second = {}
+    for t, *_ in clob.orders:
+        per_second[int(t)] = per_second.get(int(t), 0) + 1
+
+    def ms(v):
+        return round(v, 2) if v is not None else None
+
+    pe = trader.positions
+    return {
+        'elapsed_sec': round(elapsed, 2),
+        'signals': dict(writer.counts),
+        'orders': {
+            'total': len(clob.orders),
+            'throughput_per_sec': round(len(clob.orders) / elapsed, 1) if elapsed else 0.0,
+            'peak_per_sec': max(per_second.values()) if per_second else 0,
+            'untracked': untracked,
+        },
+        'dropped_signals': len(set(writer.written) - set(ordered)),
+        'duplicate_signals': sum(1 for times in ordered.values() if len(times) > 1),
+        'ingestion_lag_ms': {
+            'p50': ms(percentile(lags, 50)),
+            'p95': ms(percentile(lags, 95)),
+            'p99': ms(percentile(lags, 99)),
+            'max': ms(max(lags) if lags else None),
+        },
+        'memory_mb': memory,
+        'positions': {
+            'fills': pe.fills,
+            'exposure': round(pe.exposure(), 2),
+            'resolver_fetches': trader.resolver.fetches,
+        },
+        'event_log': LOG.stats(),
+    }
+
+def print_report(report, path):
+    print("\n" + "="*90)
+    print("📈 REPORTE DE CARGA")
+    print("="*90)
+    sig = report['signals']
+    print(f"Duración: {report['elapsed_sec']}s")
+    print(f"Filas escritas: {sig['rows']} (válidas BTC: {sig['valid']}, malformadas: {sig['malformed']}, "
+          f"otros símbolos: {sig['other_symbol']}, ráfagas: {sig['bursts']}, rotaciones: {sig['rotations']} "
+          f"(diferidas {sig['rotations_deferred']} veces))")
+    orders = report['orders']
+    print(f"Órdenes: {orders['total']} | {orders['throughput_per_sec']}/s (pico {orders['peak_per_sec']}/s)")
+    print(f"Señales perdidas: {report['dropped_signals']} | duplicadas: {report['duplicate_signals']}")
+    lag = report['ingestion_lag_ms']
+    print(f"Lag de ingesta (ms): p50 {lag['p50']} | p95 {lag['p95']} | p99 {lag['p99']} | máx {lag['max']}")
+    mem = report['memory_mb']
+    if mem:
+        top = ", ".join(f"{line} +{kb} KB" for line, kb in mem['top_growth'])
+        print(f"Memoria de uso.py (MB): inicio {mem['start']} → fin {mem['end']} (crecimiento {mem['growth']}) | {top}")
+    else:
+        print("Memoria: no medida (usa --memory)")
+    ev = report['event_log']
+    print(f"Log de eventos: {ev['emitted']} eventos, {ev['dropped']} descartados, {ev['avg_emit_us']} µs/evento")
+    print(f"📁 Reporte completo: {path}")
+    print("="*90)
+
+# ==================== MAIN ====================
+def main():
+    parser = argparse.ArgumentParser(description="Generador de carga para check_mt4_signals / place_market_order")
+    parser.add_argument("--rate", type=float, default=100, help="Filas por segundo (default: 100)")
+    parser.add_argument("--duration", type=float, default=30, help="Segundos de escritura (default: 30)")
+    parser.add_argument("--burst-prob", type=float, default=0.1, help="Probabilidad de ráfaga por segundo")
+    parser.add_argument("--burst-size", type=int, default=200, help="Filas extra por ráfaga")
+    parser.add_argument("--malformed", type=float, default=0.02, help="Fracción de filas malformadas")
+    parser.add_argument("--other-symbols", type=float, default=0.1, help="Fracción de filas no BTC")
+    parser.add_argument("--rotate-every", type=int, default=5000, help="Rota el CSV cada N filas (0 = nunca)")
+    parser.add_argument("--poll", type=float, default=0.05, help="Intervalo entre lecturas del trader (s)")
+    parser.add_argument("--clob-latency-ms", type=float, default=0.0, help="Latencia simulada de post_order")
+    parser.add_argument("--drain", type=float, default=5.0, help="Segundos extra de lectura al terminar")
+    parser.add_argument("--memory", action="store_true",
+                        help="Mide la memoria de uso.py con tracemalloc (agrega overhead: el lag de esa corrida sube)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "polymarket-loadgen"))
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    Config.CSV_PATH = os.path.join(args.out, "Sinal.csv")
+    Config.LAST_TIMESTAMP = 0
+    LOG.path = os.path.join(args.out, "events.jsonl")
+    for old in glob.glob(LOG.path + "*"):
+        os.remove(old)
+    Config.LOG_BACKUPS = None  # Se rota igual, pero no se pierde ningún evento para el reporte
+    LOG.console = False
+    LOG.start()
+
+    clob = FakeClob(latency_ms=args.clob_latency_ms)
+    trader = PolymarketTrader(read_client=clob, auth_client=clob)
+    trader.resolver.fetch = clob.get_market_by_slug
+    clob.user_channel = LocalUserChannel(trader.positions)
+
+    writer = SignalWriter(Config.CSV_PATH, args.rate, args.duration, args.burst_prob, args.burst_size,
+                          args.malformed, args.other_symbols, args.rotate_every, args.seed)
+    writer_thread = threading.Thread(target=writer.run, name="signal-writer", daemon=True)
+
+    print(f"🚀 Carga: {args.rate:.0f} filas/s por {args.duration:.0f}s → {Config.CSV_PATH}")
+    if args.memory:
+        tracemalloc.start()
+    mem_start = uso_snapshot() if args.memory else None
+    start = time.perf_counter()
+    drain_until = None
+    writer_thread.start()
+
+    try:
+        while True:
+            writer.read(trader.check_mt4_signals)
+            if writer.done.is_set():
+                if drain_until is None:
+                    drain_until = time.perf_counter() + args.drain
+                elif time.perf_counter() >= drain_until:
+                    break
+            time.sleep(args.poll)
+    except KeyboardInterrupt:
+        print("\n⏹️ Carga detenida por usuario.")
+
+    elapsed = time.perf_counter() - start
+    # Las instantáneas se toman fuera del loop medido (cada una recorre todas las asignaciones)
+    memory = memory_report(mem_start, uso_snapshot()) if args.memory else None
+    LOG.stop()
+    tracemalloc.stop()
+
+    report = build_report(writer, clob, trader, elapsed, memory)
+    path = os.path.join(args.out, "report.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print_report(report, path)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,11 +13,26 @@ from py_clob_client.clob_types import (
     OrderType, 
     OpenOrderParams, 
     BalanceAllowanceParams, 
-    AssetType
+    AssetType,
+    BookParams
 )
 from py_clob_client.order_builder.constants import BUY, SELL
 import csv
 import os
+import sys
+import glob
+import argparse
+from contextlib import contextmanager
+
+try:
+    import websocket  # websocket-client, solo para el canal de usuario en vivo
+except ImportError:
+    websocket = None
+import threading
+from collections import deque
+from array import array
+import heapq
+from requests.adapters import HTTPAdapter
 
 # ==================== CONFIG ====================
 class Config:
@@ -39,6 +54,38 @@ class Config:
     # Nueva config para integración con MT4
     CSV_PATH = None  # Se buscará automáticamente
     LAST_TIMESTAMP = 0  # Global para rastrear la última señal procesada (inicializa en 0)
+    SIGNAL_DEDUP_WINDOW_SEC = 300   # Tiempo que se recuerda la identidad de filas ya procesadas
+    SIGNAL_DEFAULT_EXPIRATION_MIN = 15  # Si la señal trae una expiración inválida
+    SIGNAL_TZ_OFFSET_SEC = 0        # Desfase de la hora de MT4 respecto a UTC (ej: GMT+2 = 7200)
+    RESOLVER_MISS_TTL_SEC = 10      # No reintenta un mercado no encontrado antes de este tiempo
+    
+    # Conexiones persistentes hacia Gamma y CLOB
+    HTTP_POOL_SIZE = 4
+    KEEPALIVE_INTERVAL_SEC = 20     # Ping liviano si un host lleva este tiempo sin uso
+    SERVER_IDLE_TIMEOUT_SEC = 60    # Timeout de inactividad estimado del servidor
+    SESSION_MAX_AGE_SEC = 900       # Recicla la sesión Gamma antes de que el servidor la corte
+    RECONNECT_MAX_BACKOFF_SEC = 300 # Espera máxima entre pings fallidos a un host caído
+    
+    # Log estructurado de eventos (JSON-lines rotativo)
+    LOG_PATH = os.path.expanduser("~/Library/Logs/PolymarketBot/events.jsonl")
+    LOG_LEVEL = "INFO"              # DEBUG, INFO, WARN, ERROR (modificable en caliente)
+    LOG_CONSOLE = True              # Vista legible en consola
+    LOG_FLUSH_SEC = 0.2             # Intervalo del hilo escritor
+    LOG_QUEUE_MAX = 50000           # Si se llena se descartan los eventos más viejos
+    LOG_MAX_BYTES = 5 * 1024 * 1024
+    LOG_BACKUPS = 5                 # Archivos rotados a conservar (None = todos)
+    
+    # Motor de posiciones y límites de riesgo
+    POSITIONS_CAPACITY = 256        # Tamaño inicial de los arrays (crece si hace falta)
+    MAX_EXPOSURE_USDC = None        # Valor de mercado máximo abierto (None = sin límite)
+    MAX_LOSS_USDC = None            # Pérdida máxima realizada + no realizada (None = sin límite)
+    USER_WS_URL = "wss://ws-subscriptions-clob.polymarket.com/ws/user"
+    SETTLE_RETRY_SEC = 30           # Reintento si el mercado cerrado aún no publica resolución
+    SETTLE_FALLBACK_SEC = 3600      # Tras este tiempo sin resolución se liquida a la última marca
+    
+    # Modo profiling
+    PROFILE_DIR = os.path.expanduser("~/Library/Logs/PolymarketBot/profiles")
+    PROFILE_INTERVAL_MS = 5         # Intervalo entre muestras de la pila
     
     @staticmethod
     def find_mt4_csv():
@@ -75,17 +122,894 @@ class Config:
         
         return None
 
+# ==================== LOGS ====================
+class EventLog:
+    """
+    Log estructurado no bloqueante
+    - El camino caliente solo agrega una tupla a un deque (append atómico, sin locks)
+    - Un hilo escritor agrupa los eventos en archivos JSON-lines rotativos
+    - Vista de consola opcional con mensajes legibles
+    - Nivel modificable en caliente con set_level()
+    """
+    LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+    ICONS = {'DEBUG': '·', 'INFO': 'ℹ️', 'WARN': '⚠️', 'ERROR': '❌'}
+    
+    # Plantillas para la vista de consola (el archivo guarda todos los campos)
+    TEMPLATES = {
+        'csv_missing': "❌ CSV de MT4 no encontrado en: {path} (cwd: {cwd})",
+        'csv_error': "❌ Error leyendo CSV de MT4: {error}",
+        'signal_detected': "🚨 Nueva señal de MT4 detectada: {symbol} - {action} - Exp: {expiration} min - Estrategia: {strategy}",
+        'signal_malformed': "⚠️ Fila malformada en CSV de MT4: {row} ({error})",
+        'signal_rejected': "❌ Señal descartada ({reason})",
+        'position_settled': "🏁 Mercado liquidado: {slug} (Up {up} / Down {down})",
+        'signal_routed': "🎯 Señal → {slug} (cierra en {secs_left}s)",
+        'order_placed': "✅ Orden ejecutada: {side} ${amount} token {token} → {response} "
+                        "(conexión caliente: {warm_conn}, setup ahorrado: {setup_saved_ms} ms)",
+        'order_error': "❌ Error ejecutando orden: {error}",
+        'order_unauthenticated': "❌ No autenticado para trading",
+        'market_switch': "⚠️ Mercado cerrando → cambiando automáticamente...",
+        'market_tick': "{question} | {timer} | Up {up:.3f} / Down {down:.3f}",
+        'monitor_error': "❌ Error en monitor: {error}",
+        'profile_started': "🔬 Profiling activo por {seconds}s (muestra cada {interval_ms} ms)",
+        'profile_stage': "🔬 {stage:<10} llamadas: {calls:>5} | total: {wall_ms:>9.1f} ms | CPU: {cpu_ms:>9.1f} ms | espera: {wait_ms:>9.1f} ms | muestras: {samples}",
+        'profile_written': "🔬 Profiling terminado ({samples} muestras) → {collapsed} | {speedscope}",
+    }
+    
+    def __init__(self, path=None, level=None, console=None):
+        self.path = path or Config.LOG_PATH
+        self.level = self.LEVELS[level or Config.LOG_LEVEL]
+        self.console = Config.LOG_CONSOLE if console is None else console
+        self.queue = deque(maxlen=Config.LOG_QUEUE_MAX)
+        self.emitted = 0
+        self.dropped = 0
+        self.emit_ns = 0
+        self._file = None
+        self._lock = threading.Lock()  # Solo lo usa el escritor, nunca emit()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def emit(self, level, event, **fields):
+        """Encola un evento; nunca bloquea ni toca disco"""
+        t0 = time.perf_counter_ns()
+        if self.LEVELS[level] < self.level:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append((time.time(), level, event, fields))
+        self.emitted += 1
+        self.emit_ns += time.perf_counter_ns() - t0
+    
+    def debug(self, event, **fields):
+        self.emit('DEBUG', event, **fields)
+    
+    def info(self, event, **fields):
+        self.emit('INFO', event, **fields)
+    
+    def warn(self, event, **fields):
+        self.emit('WARN', event, **fields)
+    
+    def error(self, event, **fields):
+        self.emit('ERROR', event, **fields)
+    
+    def set_level(self, level):
+        level = level.upper()
+        if level not in self.LEVELS:
+            raise ValueError(f"Nivel inválido: {level}")
+        self.level = self.LEVELS[level]
+    
+    def level_name(self):
+        return next(k for k, v in self.LEVELS.items() if v == self.level)
+    
+    def format(self, record):
+        """Convierte un evento en una línea legible para consola"""
+        ts, level, event, fields = record
+        clock = datetime.fromtimestamp(ts).strftime('%H:%M:%S')
+        template = self.TEMPLATES.get(event)
+        if template:
+            try:
+                return f"[{clock}] {template.format(**fields)}"
+            except (KeyError, ValueError, IndexError):
+                pass
+        details = " ".join(f"{k}={v}" for k, v in fields.items())
+        return f"[{clock}] {self.ICONS[level]} {event} {details}".rstrip()
+    
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return self._file
+    
+    def backups(self):
+        """Archivos rotados del más viejo al más nuevo (sufijo = momento de rotación en ns)"""
+        names = [p for p in glob.glob(f"{glob.escape(self.path)}.*") if p.rsplit(".", 1)[1].isdigit()]
+        return sorted(names, key=lambda p: int(p.rsplit(".", 1)[1]))
+    
+    def _rotate(self):
+        """Renombra el archivo actual con un sufijo único; no renumera los anteriores"""
+        self._file.close()
+        self._file = None
+        os.replace(self.path, f"{self.path}.{time.time_ns()}")
+        if Config.LOG_BACKUPS is not None:
+            old = self.backups()
+            for name in old[:max(0, len(old) - Config.LOG_BACKUPS)]:
+                os.remove(name)
+    
+    def flush(self):
+        """Escribe en lote todo lo pendiente (hilo escritor o al salir)"""
+        with self._lock:
+            batch = []
+            while self.queue:
+                batch.append(self.queue.popleft())
+            if not batch:
+                return
+            
+            if self.console:
+                for record in batch:
+                    print(self.format(record))
+            
+            lines = []
+            for ts, level, event, fields in batch:
+                rec = {'ts': round(ts, 6), 'level': level, 'event': event}
+                rec.update(fields)
+                lines.append(json.dumps(rec, ensure_ascii=False, default=str))
+            chunk = "\n".join(lines) + "\n"
+            
+            try:
+                f = self._open()
+                if f.tell() + len(chunk) > Config.LOG_MAX_BYTES and f.tell() > 0:
+                    self._rotate()
+                    f = self._open()
+                f.write(chunk)
+                f.flush()
+            except OSError as e:
+                print(f"⚠️ No se pudo escribir log de eventos: {e}")
+    
+    def _run(self):
+        while not self._stop.wait(Config.LOG_FLUSH_SEC):
+            self.flush()
+        self.flush()
+    
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self.flush()
+    
+    def stats(self):
+        """Costo medido de emit() en el camino caliente"""
+        avg_us = (self.emit_ns / self.emitted / 1000) if self.emitted else 0.0
+        return {
+            'level': self.level_name(),
+            'emitted': self.emitted,
+            'dropped': self.dropped,
+            'pending': len(self.queue),
+            'avg_emit_us': round(avg_us, 2),
+        }
+
+LOG = EventLog()
+
+# ==================== CONEXIONES ====================
+class ConnectionManager:
+    """
+    Mantiene conexiones keep-alive calientes hacia Gamma y CLOB
+    - Gamma: requests.Session con pool de conexiones reutilizables
+    - CLOB: py_clob_client reutiliza su propio cliente HTTP, aquí solo se mantiene caliente
+    - Un hilo en segundo plano envía pings livianos mientras el bot está ocioso
+    - Mide latencia fría (con handshake) vs caliente para estimar el ahorro por orden
+    """
+    HOSTS = ('gamma', 'clob')
+    
+    def __init__(self):
+        self.session = self._new_session()
+        self.session_born = time.time()
+        self.clob_client = None
+        self.last_use = {h: 0.0 for h in self.HOSTS}
+        self.failures = {h: 0 for h in self.HOSTS}
+        self.retry_at = {h: 0.0 for h in self.HOSTS}   # No se vuelve a hacer ping antes de esto
+        self.cold_ms = {h: None for h in self.HOSTS}  # Promedio móvil con conexión nueva
+        self.warm_ms = {h: None for h in self.HOSTS}  # Promedio móvil con conexión reutilizada
+        self.saved_ms_total = 0.0
+        self.warm_orders = 0
+        self.cold_orders = 0
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Config.HTTP_POOL_SIZE)
+        session.mount("https://", adapter)
+        return session
+    
+    def is_warm(self, host):
+        """True si la última conexión al host sigue dentro del timeout del servidor"""
+        return time.time() - self.last_use[host] < Config.SERVER_IDLE_TIMEOUT_SEC
+    
+    def _record(self, host, elapsed_ms, warm):
+        samples = self.warm_ms if warm else self.cold_ms
+        prev = samples[host]
+        samples[host] = elapsed_ms if prev is None else prev * 0.8 + elapsed_ms * 0.2
+        self.last_use[host] = time.time()
+    
+    def get(self, url, **kwargs):
+        """GET hacia Gamma reutilizando la sesión persistente"""
+        warm = self.is_warm('gamma')
+        t0 = time.perf_counter()
+        r = self.session.get(url, **kwargs)
+        self._record('gamma', (time.perf_counter() - t0) * 1000, warm)
+        return r
+    
+    def _failed(self, host):
+        """Backoff exponencial tras un ping fallido para no martillar un host caído"""
+        self.failures[host] += 1
+        delay = Config.KEEPALIVE_INTERVAL_SEC * 2 ** (self.failures[host] - 1)
+        self.retry_at[host] = time.time() + min(delay, Config.RECONNECT_MAX_BACKOFF_SEC)
+    
+    def ping_gamma(self):
+        try:
+            self.get(Config.GAMMA_API, timeout=5)
+            self.failures['gamma'] = 0
+        except Exception:
+            self._failed('gamma')
+            # Conexión caída: el próximo intento arranca con una sesión limpia
+            self.recycle(warm_up=False)
+    
+    def ping_clob(self):
+        if not self.clob_client:
+            return
+        warm = self.is_warm('clob')
+        t0 = time.perf_counter()
+        try:
+            self.clob_client.get_ok()
+        except Exception:
+            self._failed('clob')
+            return
+        self.failures['clob'] = 0
+        self._record('clob', (time.perf_counter() - t0) * 1000, warm)
+    
+    def recycle(self, warm_up=True):
+        """Reemplaza la sesión Gamma y hace el handshake antes de que se necesite"""
+        old = self.session
+        self.session = self._new_session()
+        self.session_born = time.time()
+        self.last_use['gamma'] = 0.0
+        old.close()
+        if warm_up:
+            self.ping_gamma()
+    
+    def order_started(self):
+        """
+        Registra el estado de la conexión CLOB al enviar una orden
+        Retorna: (is_warm, ms_ahorrados_estimados)
+        """
+        warm = self.is_warm('clob')
+        cold, hot = self.cold_ms['clob'], self.warm_ms['clob']
+        saved = 0.0
+        if warm:
+            self.warm_orders += 1
+            if cold is not None and hot is not None:
+                saved = max(0.0, cold - hot)
+                self.saved_ms_total += saved
+        else:
+            self.cold_orders += 1
+        return warm, saved
+    
+    def order_finished(self):
+        self.last_use['clob'] = time.time()
+    
+    def _run(self):
+        while not self._stop.wait(1.0):
+            now = time.time()
+            if now >= self.retry_at['gamma']:
+                if now - self.session_born > Config.SESSION_MAX_AGE_SEC:
+                    self.recycle()
+                elif now - self.last_use['gamma'] >= Config.KEEPALIVE_INTERVAL_SEC:
+                    self.ping_gamma()
+            if now >= self.retry_at['clob'] and now - self.last_use['clob'] >= Config.KEEPALIVE_INTERVAL_SEC:
+                self.ping_clob()
+    
+    def start(self, clob_client):
+        """Abre las conexiones iniciales y arranca el hilo keep-warm"""
+        self.clob_client = clob_client
+        self.ping_gamma()
+        self.ping_clob()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="keep-warm", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def summary(self):
+        """Resumen de conexiones y ahorro acumulado"""
+        def fmt(v):
+            return f"{v:.0f} ms" if v is not None else "N/A"
+        lines = []
+        for h in self.HOSTS:
+            lines.append(f"{h.upper():5} fría: {fmt(self.cold_ms[h])} | caliente: {fmt(self.warm_ms[h])}")
+        lines.append(f"Órdenes con conexión caliente: {self.warm_orders} | fría: {self.cold_orders}")
+        lines.append(f"Setup de conexión ahorrado: {self.saved_ms_total:.0f} ms")
+        return lines
+
+# ==================== POSICIONES ====================
+class PositionEngine:
+    """
+    Posiciones, fills y P&L en tiempo real
+    - Columnas en arrays contiguos (cantidad, costo, marca, realizado) indexadas por slot
+    - Totales de exposición/costo/realizado mantenidos incrementalmente
+    - on_tick() actualiza mark-to-market en O(1); las consultas leen los totales en O(1)
+    - Se alimenta de respuestas de post_order y del canal de usuario del CLOB
+    - Al cerrar cada mercado sus tokens se liquidan al precio de resolución y salen de los totales
+    """
+    
+    def __init__(self, capacity=None):
+        capacity = capacity or Config.POSITIONS_CAPACITY
+        self.qty = array('d', [0.0]) * capacity        # Shares abiertas
+        self.cost = array('d', [0.0]) * capacity       # Costo de las shares abiertas
+        self.mark = array('d', [0.0]) * capacity       # Último precio conocido
+        self.realized = array('d', [0.0]) * capacity   # P&L realizado
+        self.slots = {}       # token_id -> índice en los arrays
+        self.tokens = []      # índice -> token_id
+        self.labels = {}      # token_id -> "slug Up/Down"
+        self.expiries = []    # Heap (revisar_en, cierre, slug, token_ids) de mercados por liquidar
+        self.registered = set()
+        self.total_value = 0.0
+        self.total_cost = 0.0
+        self.total_realized = 0.0
+        self.fills = 0
+        self.seen_orders = set()
+        self.seen_trades = set()
+        self._lock = threading.Lock()
+    
+    def _slot(self, token_id):
+        i = self.slots.get(token_id)
+        if i is None:
+            i = len(self.tokens)
+            if i >= len(self.qty):
+                grow = array('d', [0.0]) * len(self.qty)
+                for col in (self.qty, self.cost, self.mark, self.realized):
+                    col.extend(grow)
+            self.slots[token_id] = i
+            self.tokens.append(token_id)
+        return i
+    
+    def register_market(self, market, token_ids, end_ts=None):
+        """
+        Guarda etiquetas legibles para los tokens de un mercado
+        - end_ts: cierre del mercado (epoch); lo agenda para liquidación
+        """
+        if not token_ids:
+            return
+        slug = market.get('slug', 'N/A')
+        for token_id, name in zip(token_ids, ("Up", "Down")):
+            self.labels[token_id] = f"{slug} {name}"
+        if end_ts is not None and slug not in self.registered:
+            self.registered.add(slug)
+            with self._lock:
+                heapq.heappush(self.expiries, (end_ts, end_ts, slug, list(token_ids)))
+    
+    def _apply_fill(self, token_id, side, size, price):
+        # Requiere self._lock tomado
+        i = self._slot(token_id)
+        if self.mark[i] == 0.0:
+            self.mark[i] = price
+        old_value = self.qty[i] * self.mark[i]
+        
+        if side.upper() == "BUY":
+            self.qty[i] += size
+            self.cost[i] += size * price
+            self.total_cost += size * price
+        else:
+            held = self.qty[i]
+            sold = min(size, held)
+            if sold > 0:
+                avg = self.cost[i] / held
+                pnl = sold * (price - avg)
+                self.realized[i] += pnl
+                self.total_realized += pnl
+                self.cost[i] -= sold * avg
+                self.total_cost -= sold * avg
+                self.qty[i] -= sold
+        
+        self.total_value += self.qty[i] * self.mark[i] - old_value
+        self.fills += 1
+    
+    def apply_fill(self, token_id, side, size, price):
+        """Aplica un fill; SELL realiza P&L contra el costo promedio"""
+        if size <= 0:
+            return
+        with self._lock:
+            self._apply_fill(token_id, side, size, price)
+    
+    def on_tick(self, token_id, price):
+        """Mark-to-market O(1) de un token"""
+        i = self.slots.get(token_id)
+        if i is None:
+            return
+        with self._lock:
+            self.total_value += self.qty[i] * (price - self.mark[i])
+            self.mark[i] = price
+    
+    def on_order_response(self, token_id, side, resp):
+        """
+        Extrae el fill de la respuesta de post_order (órdenes FOK: todo o nada)
+        - BUY: makingAmount = USDC entregados, takingAmount = shares recibidas
+        - SELL: makingAmount = shares entregadas, takingAmount = USDC recibidos
+        """
+        if not isinstance(resp, dict) or not resp.get('success', True):
+            return
+        if str(resp.get('status', '')).lower() != 'matched':
+            return
+        try:
+            making = float(resp.get('makingAmount') or 0)
+            taking = float(resp.get('takingAmount') or 0)
+        except (TypeError, ValueError):
+            return
+        if side.upper() == "BUY":
+            size, usdc = taking, making
+        else:
+            size, usdc = making, taking
+        if size <= 0:
+            return
+        order_id = resp.get('orderID')
+        with self._lock:
+            # El trade del canal de usuario puede haber llegado antes que la respuesta
+            if order_id:
+                if order_id in self.seen_orders:
+                    return
+                self.seen_orders.add(order_id)
+            self._apply_fill(token_id, side, size, usdc / size)
+    
+    def on_message(self, msg):
+        """Procesa mensajes del canal de usuario (trades) y de mercado (precios)"""
+        event_type = msg.get('event_type')
+        if event_type == 'trade':
+            if msg.get('status') in ('FAILED', 'RETRYING'):
+                return
+            try:
+                token_id, side = msg['asset_id'], msg['side']
+                size, price = float(msg['size']), float(msg['price'])
+            except (KeyError, TypeError, ValueError):
+                return
+            trade_id = msg.get('id')
+            order_id = msg.get('taker_order_id')
+            with self._lock:
+                if trade_id in self.seen_trades or order_id in self.seen_orders:
+                    return
+                self.seen_trades.add(trade_id)
+                # La respuesta de post_order de esta orden ya no debe volver a aplicarse
+                if order_id:
+                    self.seen_orders.add(order_id)
+                if size > 0:
+                    self._apply_fill(token_id, side, size, price)
+        elif event_type == 'last_trade_price':
+            try:
+                self.on_tick(msg['asset_id'], float(msg['price']))
+            except (KeyError, TypeError, ValueError):
+                return
+        elif event_type == 'price_change':
+            for change in msg.get('price_changes', []):
+                try:
+                    bid, ask = float(change['best_bid']), float(change['best_ask'])
+                    self.on_tick(change['asset_id'], (bid + ask) / 2)
+                except (KeyError, TypeError, ValueError):
+                    continue
+    
+    def held_tokens(self):
+        """Tokens con shares abiertas (los que necesitan mark-to-market)"""
+        return [t for t, i in self.slots.items() if self.qty[i] > 0]
+    
+    def due_settlements(self, now):
+        """Mercados cuyo cierre (o reintento) ya pasó: [(cierre, slug, token_ids)]"""
+        due = []
+        with self._lock:
+            while self.expiries and self.expiries[0][0] <= now:
+                _, end_ts, slug, token_ids = heapq.heappop(self.expiries)
+                if any(self.qty[self.slots[t]] > 0 for t in token_ids if t in self.slots):
+                    due.append((end_ts, slug, token_ids))
+        return due
+    
+    def retry_settlement(self, when, end_ts, slug, token_ids):
+        with self._lock:
+            heapq.heappush(self.expiries, (when, end_ts, slug, token_ids))
+    
+    def settle(self, token_id, price):
+        """Liquida un token al precio de resolución: realiza P&L y lo saca de los totales en O(1)"""
+        i = self.slots.get(token_id)
+        if i is None:
+            return
+        with self._lock:
+            qty, cost = self.qty[i], self.cost[i]
+            pnl = qty * price - cost
+            self.realized[i] += pnl
+            self.total_realized += pnl
+            self.total_cost -= cost
+            self.total_value -= qty * self.mark[i]
+            self.qty[i] = 0.0
+            self.cost[i] = 0.0
+            self.mark[i] = price
+    
+    # --- Consultas O(1) ---
+    def exposure(self):
+        return self.total_value
+    
+    def unrealized_pnl(self):
+        return self.total_value - self.total_cost
+    
+    def total_pnl(self):
+        return self.total_realized + self.total_value - self.total_cost
+    
+    def check_limits(self, amount):
+        """
+        Verifica límites de riesgo antes de abrir una posición
+        Retorna: (ok, motivo)
+        """
+        if Config.MAX_EXPOSURE_USDC is not None and self.total_value + amount > Config.MAX_EXPOSURE_USDC:
+            return False, f"exposición ${self.total_value + amount:.2f} > límite ${Config.MAX_EXPOSURE_USDC:.2f}"
+        if Config.MAX_LOSS_USDC is not None and self.total_pnl() < -Config.MAX_LOSS_USDC:
+            return False, f"P&L ${self.total_pnl():.2f} supera la pérdida máxima ${Config.MAX_LOSS_USDC:.2f}"
+        return True, ""
+    
+    def position(self, token_id):
+        i = self.slots.get(token_id)
+        if i is None:
+            return None
+        qty, cost, mark = self.qty[i], self.cost[i], self.mark[i]
+        return {
+            'token_id': token_id,
+            'label': self.labels.get(token_id, token_id[:16]),
+            'qty': qty,
+            'avg_entry': cost / qty if qty > 0 else 0.0,
+            'mark': mark,
+            'value': qty * mark,
+            'unrealized': qty * mark - cost,
+            'realized': self.realized[i],
+        }
+    
+    def positions(self):
+        return [self.position(t) for t in self.tokens]
+
+class UserChannelFeed:
+    """
+    Stream del canal de usuario del CLOB hacia el PositionEngine
+    - Requiere websocket-client; si no está instalado el motor sigue con las respuestas de órdenes
+    """
+    
+    def __init__(self, engine, creds):
+        self.engine = engine
+        self.creds = creds
+        self.ws = None
+        self._thread = None
+    
+    def _on_open(self, ws):
+        ws.send(json.dumps({
+            'auth': {
+                'apiKey': self.creds.api_key,
+                'secret': self.creds.api_secret,
+                'passphrase': self.creds.api_passphrase,
+            },
+            'type': 'user',
+            'markets': [],
+        }))
+    
+    def _on_message(self, ws, raw):
+        if raw == 'PONG':
+            return
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return
+        for msg in data if isinstance(data, list) else [data]:
+            self.engine.on_message(msg)
+    
+    def _run(self):
+        while True:
+            self.ws = websocket.WebSocketApp(
+                Config.USER_WS_URL,
+                on_open=self._on_open,
+                on_message=self._on_message,
+            )
+            self.ws.run_forever(ping_interval=10, ping_payload='PING')
+            LOG.warn('user_channel_reconnect')
+            time.sleep(5)
+    
+    def start(self):
+        if websocket is None:
+            LOG.warn('user_channel_disabled', reason="websocket-client no instalado")
+            return False
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="user-channel", daemon=True)
+            self._thread.start()
+        return True
+
+class LocalUserChannel:
+    """
+    Sustituto local del canal de usuario (pruebas y generador de carga)
+    - publish() entrega mensajes con el mismo formato del websocket al motor
+    """
+    
+    def __init__(self, engine):
+        self.engine = engine
+        self.published = 0
+    
+    def publish(self, msg):
+        self.published += 1
+        self.engine.on_message(msg)
+    
+    def start(self):
+        return True
+
+# ==================== PROFILER ====================
+class StageProfiler:
+    """
+    Profiler por muestreo de bajo overhead para el hilo principal
+    - Un hilo toma la pila con sys._current_frames() cada PROFILE_INTERVAL_MS
+    - Cada muestra se etiqueta con la etapa activa (discovery, settlement, marks, signal, order, display)
+    - Por etapa mide CPU (thread_time) vs espera (tiempo total - CPU), sin contar etapas hijas
+    - Exporta collapsed stacks (flamegraph.pl) y JSON de speedscope
+    """
+    
+    def __init__(self):
+        self.active = False
+        self.target_tid = None
+        self.stage_stack = []
+        self.samples = {}
+        self.stats = {}
+        self.started_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @contextmanager
+    def stage(self, name):
+        """Marca una etapa del pipeline; sin costo apreciable si el profiler está inactivo"""
+        if not self.active or threading.get_ident() != self.target_tid:
+            yield
+            return
+        entry = [name, time.perf_counter(), time.thread_time(), 0.0, 0.0]
+        self.stage_stack.append(entry)
+        try:
+            yield
+        finally:
+            self.stage_stack.pop()
+            wall = time.perf_counter() - entry[1]
+            cpu = time.thread_time() - entry[2]
+            st = self.stats.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            st['calls'] += 1
+            st['wall'] += wall - entry[3]
+            st['cpu'] += cpu - entry[4]
+            if self.stage_stack:
+                parent = self.stage_stack[-1]
+                parent[3] += wall
+                parent[4] += cpu
+    
+    def _sample(self):
+        frame = sys._current_frames().get(self.target_tid)
+        if frame is None:
+            return
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stage = self.stage_stack[-1][0] if self.stage_stack else 'idle'
+        names.append(stage)
+        key = ";".join(reversed(names))
+        self.samples[key] = self.samples.get(key, 0) + 1
+    
+    def _run(self, seconds):
+        interval = Config.PROFILE_INTERVAL_MS / 1000
+        # Sin esto el muestreador solo obtiene el GIL cuando el hilo principal espera I/O
+        prev_switch = sys.getswitchinterval()
+        sys.setswitchinterval(min(prev_switch, interval / 5))
+        try:
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline and not self._stop.wait(interval):
+                self._sample()
+        finally:
+            sys.setswitchinterval(prev_switch)
+            self.active = False
+        self.write()
+    
+    def start(self, seconds, thread_id=None):
+        """Perfila el hilo indicado (por defecto el que llama) durante `seconds`"""
+        if self.active:
+            return False
+        self.target_tid = thread_id or threading.get_ident()
+        self.stage_stack = []
+        self.samples = {}
+        self.stats = {}
+        self.started_at = time.time()
+        self._stop.clear()
+        self.active = True
+        self._thread = threading.Thread(target=self._run, args=(seconds,), name="profiler", daemon=True)
+        self._thread.start()
+        LOG.info('profile_started', seconds=seconds, interval_ms=Config.PROFILE_INTERVAL_MS)
+        return True
+    
+    def stop(self):
+        """Termina la ventana antes de tiempo y escribe los resultados"""
+        if self._thread is not None and self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(timeout=5)
+    
+    def stage_breakdown(self):
+        """CPU vs espera por etapa (ms) junto con las muestras de cada una"""
+        per_stage = {}
+        for key, count in self.samples.items():
+            stage = key.split(";", 1)[0]
+            per_stage[stage] = per_stage.get(stage, 0) + count
+        rows = []
+        for stage in sorted(set(self.stats) | set(per_stage)):
+            st = self.stats.get(stage, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            rows.append({
+                'stage': stage,
+                'calls': st['calls'],
+                'wall_ms': st['wall'] * 1000,
+                'cpu_ms': st['cpu'] * 1000,
+                'wait_ms': max(0.0, st['wall'] - st['cpu']) * 1000,
+                'samples': per_stage.get(stage, 0),
+            })
+        return rows
+    
+    def _speedscope(self):
+        frames, index, samples, weights = [], {}, [], []
+        for key, count in self.samples.items():
+            stack = []
+            for name in key.split(";"):
+                if name not in index:
+                    index[name] = len(frames)
+                    frames.append({'name': name})
+                stack.append(index[name])
+            samples.append(stack)
+            weights.append(count * Config.PROFILE_INTERVAL_MS)
+        return {
+            '$schema': "https://www.speedscope.app/file-format-schema.json",
+            'name': "uso.py monitor",
+            'exporter': "uso.py StageProfiler",
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': "main thread",
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+    
+    def write(self, out_dir=None):
+        out_dir = out_dir or Config.PROFILE_DIR
+        os.makedirs(out_dir, exist_ok=True)
+        base = os.path.join(out_dir, "profile-" + datetime.fromtimestamp(self.started_at).strftime('%Y%m%d-%H%M%S'))
+        
+        with open(base + ".collapsed", 'w', encoding='utf-8') as f:
+            for key, count in sorted(self.samples.items()):
+                f.write(f"{key} {count}\n")
+        with open(base + ".speedscope.json", 'w', encoding='utf-8') as f:
+            json.dump(self._speedscope(), f)
+        breakdown = self.stage_breakdown()
+        with open(base + ".stages.json", 'w', encoding='utf-8') as f:
+            json.dump(breakdown, f, indent=2)
+        
+        for row in breakdown:
+            LOG.info('profile_stage', **row)
+        LOG.info('profile_written', samples=sum(self.samples.values()),
+                 collapsed=base + ".collapsed", speedscope=base + ".speedscope.json")
+        return base
+
+PROFILER = StageProfiler()
+
+# ==================== RESOLVER ====================
+class MarketResolver:
+    """
+    Resuelve cada señal de MT4 al mercado 15m correcto
+    - Índice epoch de inicio -> (mercado, token_ids) con lookup O(1)
+    - Se alimenta de cada búsqueda de mercados y de las selecciones manuales
+    - Si el epoch no está en caché lo busca por slug; búsquedas simultáneas del mismo epoch se deduplican
+    """
+    INTERVAL_SEC = 900
+    
+    def __init__(self, fetch):
+        self.fetch = fetch          # fetch(slug) -> mercado o None
+        self.index = {}
+        self.misses = {}            # epoch -> momento de la última búsqueda fallida
+        self.inflight = {}          # epoch -> threading.Event de la búsqueda en curso
+        self.fetches = 0
+        self._lock = threading.Lock()
+    
+    def add(self, market):
+        """Indexa un mercado por el epoch de su slug; retorna el epoch o None"""
+        slug = market.get('slug', '')
+        if not slug.startswith(Config.SERIES_PATTERN):
+            return None
+        try:
+            epoch = int(slug[len(Config.SERIES_PATTERN):])
+            tokens = json.loads(market.get('clobTokenIds', '[]'))
+        except (ValueError, TypeError):
+            return None
+        self.index[epoch] = (market, tokens)
+        self.misses.pop(epoch, None)
+        return epoch
+    
+    def target_epoch(self, signal_ts, expiration_min):
+        """
+        Epoch del mercado con mayor solapamiento con [señal, señal + expiración]
+        - Se toma la ventana que contiene el punto medio; en empate gana la ventana posterior
+        - Señal 10:15 + 15 min → mercado 10:15-10:30
+        - Señal 10:16 + 15 min → mercado 10:15-10:30 (14 min de solapamiento vs 1 min)
+        - Señal 10:25 + 15 min → mercado 10:30-10:45 (aún no abre)
+        """
+        start = signal_ts - Config.SIGNAL_TZ_OFFSET_SEC
+        midpoint = start + int(expiration_min) * 30
+        return midpoint // self.INTERVAL_SEC * self.INTERVAL_SEC
+    
+    def resolve(self, epoch):
+        """Retorna (mercado, token_ids) del epoch, buscándolo si no está en caché, o None"""
+        entry = self.index.get(epoch)
+        if entry is None:
+            entry = self._fetch(epoch)
+        return entry
+    
+    def _fetch(self, epoch):
+        with self._lock:
+            entry = self.index.get(epoch)
+            if entry is not None:
+                return entry
+            if time.time() - self.misses.get(epoch, 0) < Config.RESOLVER_MISS_TTL_SEC:
+                return None
+            event = self.inflight.get(epoch)
+            owner = event is None
+            if owner:
+                event = self.inflight[epoch] = threading.Event()
+        
+        if not owner:
+            event.wait(timeout=10)
+            return self.index.get(epoch)
+        
+        try:
+            self.fetches += 1
+            market = self.fetch(f"{Config.SERIES_PATTERN}{epoch}")
+            if market is None or self.add(market) != epoch:
+                self.misses[epoch] = time.time()
+        finally:
+            with self._lock:
+                self.inflight.pop(epoch, None)
+            event.set()
+        return self.index.get(epoch)
+    
+    def prune(self, keep_after):
+        """Descarta mercados que empezaron antes de keep_after"""
+        for epoch in [e for e in self.index if e < keep_after]:
+            del self.index[epoch]
+
 # ==================== CLASE ====================
 class PolymarketTrader:
-    def __init__(self):
-        self.read_client = ClobClient(Config.CLOB_API)
-        self.auth_client = None
+    def __init__(self, read_client=None, auth_client=None):
+        """
+        - read_client/auth_client: clientes ya creados (ej: CLOB falso de loadgen.py);
+          con auth_client no se autentica ni se abren conexiones reales
+        """
+        self.read_client = read_client or ClobClient(Config.CLOB_API)
+        self.auth_client = auth_client
         self.selected_market = None
         self.selected_token_ids = None
         self.cache = []
         self.cache_time = 0
         self.upcoming = []
         self.trade_amount = 1.0  # Monto predeterminado para trades automáticos
+        self.conn = ConnectionManager()
+        self.positions = PositionEngine()
+        self.resolver = MarketResolver(self.get_market_by_slug)
+        self.user_feed = None
+        self.processed = {}         # (fila, ocurrencia) -> timestamp de las señales ya procesadas
+        self.processed_pruned_at = 0
+        self.pending = {}           # (fila, ocurrencia) -> timestamp de señales detectadas a la espera de su mercado
+        self.malformed = set()      # (fila, ocurrencia) de filas malformadas presentes en el CSV (ya registradas)
         
         # Buscar archivo CSV automáticamente si no está configurado
         if Config.CSV_PATH is None:
@@ -104,7 +1028,14 @@ class PolymarketTrader:
                     print(f"⚠️ Usando ruta por defecto: {Config.CSV_PATH}")
                     print("💡 El archivo se creará cuando MT4 genere una señal")
         
+        if auth_client is not None:
+            return
+        
         self.authenticate()
+        self.conn.start(self.auth_client or self.read_client)
+        if self.auth_client and self.auth_client.creds:
+            self.user_feed = UserChannelFeed(self.positions, self.auth_client.creds)
+            self.user_feed.start()
     
     def authenticate(self):
         try:
@@ -196,8 +1127,10 @@ class PolymarketTrader:
             m = self.get_market_by_slug(slug)
             if m:
                 btc_markets.append(m)
+                self.resolver.add(m)
                 print(f"   ✅ Encontrado: {slug}")
         
+        self.resolver.prune(timestamps[0])
         self.cache = btc_markets
         self.cache_time = now
         print(f"🔄 Total encontrados: {len(btc_markets)}")
@@ -206,7 +1139,7 @@ class PolymarketTrader:
     def get_market_by_slug(self, slug):
         """Busca mercado individual por slug en Gamma API"""
         try:
-            r = requests.get(f"{Config.GAMMA_API}/markets/slug/{slug}", timeout=5)
+            r = self.conn.get(f"{Config.GAMMA_API}/markets/slug/{slug}", timeout=5)
             if r.status_code == 200:
                 return r.json()
             return None
@@ -306,7 +1239,8 @@ class PolymarketTrader:
     def auto_switch_to_next_market(self):
         """Cambia automáticamente al siguiente mercado activo"""
         print("\n🔄 Buscando siguiente BTC 15m...")
-        cands = self.get_next_active_market()
+        with PROFILER.stage('discovery'):
+            cands = self.get_next_active_market()
         
         if not cands:
             print("❌ No hay mercados disponibles ahora")
@@ -323,8 +1257,10 @@ class PolymarketTrader:
             self.selected_token_ids = json.loads(m.get('clobTokenIds', '[]'))
         except:
             self.selected_token_ids = None
+        self.positions.register_market(m, self.selected_token_ids, self.market_end_ts(m))
         
-        self.show_detailed_preview(m)
+        with PROFILER.stage('display'):
+            self.show_detailed_preview(m)
         return True
     
     def show_detailed_preview(self, market):
@@ -382,6 +1318,52 @@ class PolymarketTrader:
         
         print("="*90 + "\n")
     
+    def market_end_ts(self, market):
+        """Cierre del mercado en epoch, o None si no se puede parsear"""
+        try:
+            return self.parse_datetime_safe(market.get('endDate', '')).timestamp()
+        except (ValueError, AttributeError):
+            return None
+    
+    def settle_positions(self):
+        """
+        Liquida posiciones de mercados ya cerrados
+        - Usa outcomePrices resueltos (1/0) de Gamma
+        - Si aún no hay resolución reintenta; pasado SETTLE_FALLBACK_SEC liquida a la última marca
+        """
+        now = time.time()
+        for end_ts, slug, token_ids in self.positions.due_settlements(now):
+            m = self.get_market_by_slug(slug)
+            prices = self.parse_outcome_prices(m) if m else None
+            if prices and sorted(prices) == [0.0, 1.0]:
+                for token_id, price in zip(token_ids, prices):
+                    self.positions.settle(token_id, price)
+                LOG.info('position_settled', slug=slug, up=prices[0], down=prices[1])
+            elif now - end_ts >= Config.SETTLE_FALLBACK_SEC:
+                for token_id in token_ids:
+                    pos = self.positions.position(token_id)
+                    if pos:
+                        self.positions.settle(token_id, pos['mark'])
+                LOG.warn('position_settled', slug=slug, up=None, down=None, reason="sin resolución, última marca")
+            else:
+                self.positions.retry_settlement(now + Config.SETTLE_RETRY_SEC, end_ts, slug, token_ids)
+    
+    def refresh_marks(self):
+        """Mark-to-market de todos los tokens con posición abierta usando midpoints del CLOB"""
+        held = self.positions.held_tokens()
+        if not held:
+            return
+        try:
+            mids = self.read_client.get_midpoints([BookParams(token_id=t) for t in held])
+        except Exception as e:
+            LOG.warn('marks_error', error=str(e))
+            return
+        for token_id in held:
+            try:
+                self.positions.on_tick(token_id, float(mids[token_id]))
+            except (KeyError, TypeError, ValueError):
+                continue
+    
     def parse_outcome_prices(self, market):
         """Extrae precios UP/DOWN del mercado"""
         s = market.get('outcomePrices', '["0.5","0.5"]')
@@ -426,78 +1408,142 @@ class PolymarketTrader:
             print(f"⚠️ Error parseando fecha: {e}")
             return "??:??", False
     
+    def _mark_processed(self, key, ts):
+        """Registra una fila como procesada y avanza la marca de agua LAST_TIMESTAMP"""
+        self.processed[key] = ts
+        self.pending.pop(key, None)
+        if ts > Config.LAST_TIMESTAMP:
+            Config.LAST_TIMESTAMP = ts
+            # Las filas bajo la marca de agua ya se saltan por timestamp
+            if ts - self.processed_pruned_at >= Config.SIGNAL_DEDUP_WINDOW_SEC:
+                cutoff = ts - Config.SIGNAL_DEDUP_WINDOW_SEC
+                self.processed = {k: v for k, v in self.processed.items() if v >= cutoff}
+                self.pending = {k: v for k, v in self.pending.items() if v >= cutoff}
+                self.processed_pruned_at = ts
+    
     def check_mt4_signals(self):
         """
         Lee el CSV de MT4 y procesa nuevas señales.
         - Asume símbolo BTC-related.
         - "call" -> BUY YES (Up)
         - "put" -> BUY NO (Down)
+        - Opera el mercado 15m donde vence la señal (timestamp + expiración), no el seleccionado
         - Usa monto configurado en self.trade_amount
-        - Solo procesa señales nuevas (timestamp > último procesado)
+        - Cada fila se procesa una sola vez (identidad de la fila, no solo el timestamp),
+          así varias señales en el mismo segundo no se pierden
+        - Una fila malformada se registra una sola vez y se salta sin cortar la lectura
+        - Si el mercado objetivo aún no existe la señal queda pendiente: se detecta una sola vez
+          y solo se registra el rechazo cuando se volvió a consultar Gamma
         """
         global Config  # Para actualizar LAST_TIMESTAMP
         
         if not os.path.exists(Config.CSV_PATH):
-            print(f"❌ CSV de MT4 no encontrado en: {Config.CSV_PATH}")
-            print(f"💡 Directorio actual: {os.getcwd()}")
-            print(f"💡 Ruta absoluta buscada: {os.path.abspath(Config.CSV_PATH)}")
-            
-            # Sugerencia: buscar archivos CSV cercanos
-            desktop_path = os.path.expanduser("~/Desktop")
-            if os.path.exists(desktop_path):
-                csv_files = [f for f in os.listdir(desktop_path) if f.endswith('.csv')]
-                if csv_files:
-                    print(f"💡 CSVs encontrados en Desktop: {csv_files}")
+            LOG.warn('csv_missing', path=os.path.abspath(Config.CSV_PATH), cwd=os.getcwd())
             return
         
         try:
             with open(Config.CSV_PATH, 'r') as file:
                 reader = csv.reader(file)
-                next(reader)  # Salta encabezado: tempo,ativo,acao,expiracao,estrategia
+                next(reader, None)  # Salta encabezado: tempo,ativo,acao,expiracao,estrategia
+                occurrences = {}
+                malformed = set()
                 
                 for row in reader:
                     if not row: continue
-                    timestamp, symbol, action, expiration, strategy = row
-                    ts = int(timestamp)
+                    # Filas idénticas (mismo segundo, misma señal) se distinguen por su ocurrencia
+                    row_id = tuple(row)
+                    n = occurrences.get(row_id, 0)
+                    occurrences[row_id] = n + 1
+                    key = (row_id, n)
+                    if key in self.processed:
+                        continue
                     
-                    if ts > Config.LAST_TIMESTAMP and symbol.lower().startswith('btc'):  # Asume símbolo BTC
-                        print(f"\n🚨 Nueva señal de MT4 detectada: {symbol} - {action.upper()} - Exp: {expiration} min - Estrategia: {strategy}")
-                        
-                        if not self.selected_token_ids or len(self.selected_token_ids) < 2:
-                            print("❌ No hay mercado seleccionado con tokens válidos. No se puede ejecutar trade.")
-                            continue
-                        
-                        bal = self.get_balance() or 0
-                        if bal < self.trade_amount:
-                            print(f"❌ Balance insuficiente para ${self.trade_amount} trade.")
-                            continue
-                        
-                        # Mapeo: call -> BUY YES (Up), put -> BUY NO (Down)
-                        if action.lower() == "call":
-                            token_id = self.selected_token_ids[0]  # YES/Up
-                            side = "BUY"
-                        elif action.lower() == "put":
-                            token_id = self.selected_token_ids[1]  # NO/Down
-                            side = "BUY"
-                        else:
-                            print("❌ Acción inválida en señal:", action)
-                            continue
-                        
-                        # Ejecuta orden con monto configurado
-                        self.place_market_order(token_id, self.trade_amount, side)
-                        
-                        # Actualiza último timestamp procesado
-                        Config.LAST_TIMESTAMP = ts
-                        
-        except Exception as e:
-            print(f"❌ Error leyendo CSV de MT4: {e}")
+                    try:
+                        timestamp, symbol, action, expiration, strategy = row
+                        ts = int(timestamp)
+                    except ValueError as e:
+                        # Sin timestamp válido no entra a processed (la marca de agua la podaría)
+                        if key not in self.malformed:
+                            LOG.warn('signal_malformed', row=row, error=str(e))
+                        malformed.add(key)
+                        continue
+                    
+                    if ts < Config.LAST_TIMESTAMP or not symbol.lower().startswith('btc'):  # Asume símbolo BTC
+                        continue
+                    
+                    if key not in self.pending:
+                        LOG.info('signal_detected', signal_ts=ts, symbol=symbol, action=action.upper(),
+                                 expiration=expiration, strategy=strategy)
+                    
+                    # Mapeo: call -> BUY YES (Up), put -> BUY NO (Down)
+                    if action.lower() not in ("call", "put"):
+                        LOG.warn('signal_rejected', signal_ts=ts, reason=f"acción inválida: {action}")
+                        self._mark_processed(key, ts)
+                        continue
+                    
+                    try:
+                        exp_min = int(float(expiration))
+                    except (ValueError, OverflowError):
+                        exp_min = 0
+                    if exp_min <= 0:
+                        exp_min = Config.SIGNAL_DEFAULT_EXPIRATION_MIN
+                    
+                    # Ventana vencida: nunca será válida, se descarta sin consultar Gamma
+                    epoch = self.resolver.target_epoch(ts, exp_min)
+                    slug = f"{Config.SERIES_PATTERN}{epoch}"
+                    secs_left = int(epoch + MarketResolver.INTERVAL_SEC - time.time())
+                    if secs_left <= 30:
+                        LOG.warn('signal_rejected', signal_ts=ts, reason=f"mercado objetivo {slug} ya cerró")
+                        self._mark_processed(key, ts)
+                        continue
+                    
+                    fetches = self.resolver.fetches
+                    entry = self.resolver.resolve(epoch)
+                    if entry is None or len(entry[1]) < 2:
+                        # Se registra al detectarla y tras cada reconsulta a Gamma (cada RESOLVER_MISS_TTL_SEC), no en cada pasada
+                        if key not in self.pending or self.resolver.fetches != fetches:
+                            LOG.warn('signal_rejected', signal_ts=ts,
+                                     reason=f"mercado objetivo {slug} no disponible, reintento en {Config.RESOLVER_MISS_TTL_SEC}s")
+                        self.pending[key] = ts
+                        continue
+                    market, token_ids = entry
+                    self.positions.register_market(market, token_ids, epoch + MarketResolver.INTERVAL_SEC)
+                    LOG.info('signal_routed', signal_ts=ts, slug=slug, secs_left=secs_left)
+                    
+                    # Rechazos por riesgo o balance son definitivos: la señal no se ejecuta tarde
+                    ok, reason = self.positions.check_limits(self.trade_amount)
+                    if not ok:
+                        LOG.warn('signal_rejected', signal_ts=ts, reason=reason)
+                        self._mark_processed(key, ts)
+                        continue
+                    
+                    bal = self.get_balance() or 0
+                    if bal < self.trade_amount:
+                        LOG.warn('signal_rejected', signal_ts=ts, reason=f"balance insuficiente para ${self.trade_amount}")
+                        self._mark_processed(key, ts)
+                        continue
+                    
+                    token_id = token_ids[0] if action.lower() == "call" else token_ids[1]  # YES/Up o NO/Down
+                    
+                    # Ejecuta orden con monto configurado
+                    self.place_market_order(token_id, self.trade_amount, "BUY", signal=",".join(row))
+                    
+                    # Marca la fila como procesada
+                    self._mark_processed(key, ts)
+                
+                # Solo se recuerdan las malformadas que siguen en el archivo (se vacía al rotar el CSV)
+                self.malformed = malformed
+                    
+        except (OSError, csv.Error) as e:
+            LOG.error('csv_error', error=str(e))
     
-    def monitor_mode(self):
+    def monitor_mode(self, profile_seconds=None):
         """
         Modo monitor continuo
         - Actualiza cada 5 segundos
         - Auto-switch cuando mercado cierra en <2 min
         - Verifica señales de MT4 en cada iteración
+        - profile_seconds: perfila el loop durante ese tiempo (la ventana abre aquí, no en el menú)
         - Ctrl+C para salir
         """
         print("\n" + "="*90)
@@ -506,32 +1552,50 @@ class PolymarketTrader:
         print("🔄 Auto-switch cuando cierre <2 min")
         print(f"📡 Monitoreando señales de MT4 en: {Config.CSV_PATH}")
         print(f"💰 Monto por trade: ${self.trade_amount}")
+        print(f"📝 Log de eventos: {LOG.path} (nivel {LOG.level_name()})")
         print("⌨️ Ctrl+C para salir")
         print("="*90)
         
+        if profile_seconds:
+            if PROFILER.start(profile_seconds):
+                print(f"🔬 Profiling por {profile_seconds:.0f}s → {Config.PROFILE_DIR}")
+            else:
+                print("⚠️ Ya hay un profiling en curso")
+        
         while True:
             try:
+                # Liquida mercados cerrados y actualiza marcas antes de evaluar límites de riesgo
+                with PROFILER.stage('settlement'):
+                    self.settle_positions()
+                with PROFILER.stage('marks'):
+                    self.refresh_marks()
+                
                 # Verifica señales de MT4
-                self.check_mt4_signals()
+                with PROFILER.stage('signal'):
+                    self.check_mt4_signals()
                 
                 # Verifica si debe cambiar de mercado
                 if self.should_switch_market():
-                    print("\n⚠️ Mercado cerrando → cambiando automáticamente...")
+                    LOG.info('market_switch')
+                    LOG.flush()
                     self.auto_switch_to_next_market()
                 else:
-                    # Actualiza vista del mercado actual
-                    print("\n" + "-"*90)
-                    now_str = datetime.now(pytz.timezone('America/Bogota')).strftime('%H:%M:%S -05')
-                    print(f"[{now_str}] Actualizando mercado actual...")
-                    self.show_detailed_preview(self.selected_market)
+                    # Línea compacta del mercado actual (el detalle completo se muestra al cambiar)
+                    with PROFILER.stage('display'):
+                        m = self.selected_market
+                        timer, _ = self.calculate_timer(m.get('endDate', ''))
+                        up, down = self.parse_outcome_prices(m)
+                        LOG.info('market_tick', slug=m.get('slug', 'N/A'),
+                                 question=m.get('question', 'N/A')[:50], timer=timer, up=up, down=down)
                 
                 time.sleep(Config.MONITOR_INTERVAL_SEC)
                 
             except KeyboardInterrupt:
+                LOG.flush()
                 print("\n\n⏹️ Modo monitor detenido por usuario.")
                 break
             except Exception as e:
-                print(f"❌ Error en monitor: {e}")
+                LOG.error('monitor_error', error=str(e))
                 time.sleep(10)
     
     def get_orderbook(self, token_id, depth=5):
@@ -554,15 +1618,37 @@ class PolymarketTrader:
         except Exception as e:
             print(f"❌ Error obteniendo orderbook: {e}")
     
-    def place_market_order(self, token_id, amount, side):
+    def show_positions(self):
+        """Muestra posiciones abiertas y P&L acumulado"""
+        pe = self.positions
+        print("\n" + "="*90)
+        print("📊 POSICIONES Y P&L")
+        print("="*90)
+        
+        rows = [p for p in pe.positions() if p['qty'] > 0 or p['realized'] != 0]
+        if not rows:
+            print("   Sin posiciones registradas")
+        for p in rows:
+            print(f"\n{p['label']}")
+            print(f"   Shares: {p['qty']:.4f} | Entrada prom.: {p['avg_entry']:.4f} | Marca: {p['mark']:.4f}")
+            print(f"   Valor: ${p['value']:,.2f} | No realizado: ${p['unrealized']:,.2f} | Realizado: ${p['realized']:,.2f}")
+        
+        print("\n" + "-"*90)
+        print(f"Exposición: ${pe.exposure():,.2f} | No realizado: ${pe.unrealized_pnl():,.2f} | "
+              f"Realizado: ${pe.total_realized:,.2f} | Total: ${pe.total_pnl():,.2f}")
+        print(f"Fills procesados: {pe.fills}")
+        print("="*90)
+    
+    def place_market_order(self, token_id, amount, side, signal=None):
         """
         Coloca orden de mercado
         - token_id: ID del token YES o NO
         - amount: Monto en USDC
         - side: "BUY" o "SELL"
+        - signal: fila de MT4 que origina la orden (se guarda en el log para correlacionar)
         """
         if not self.auth_client:
-            print("❌ No autenticado para trading")
+            LOG.error('order_unauthenticated', token=token_id)
             return
         
         try:
@@ -575,23 +1661,25 @@ class PolymarketTrader:
                 order_type=OrderType.FOK  # Fill-Or-Kill
             )
             
-            signed = self.auth_client.create_market_order(mo)
-            resp = self.auth_client.post_order(signed, OrderType.FOK)
+            with PROFILER.stage('order'):
+                signed = self.auth_client.create_market_order(mo)
+                warm, saved_ms = self.conn.order_started()
+                resp = self.auth_client.post_order(signed, OrderType.FOK)
+                self.conn.order_finished()
+            self.positions.on_order_response(token_id, side, resp)
             
-            print("✅ Orden ejecutada:")
-            print(f"   Token: {token_id[:16]}...")
-            print(f"   Lado: {side}")
-            print(f"   Monto: ${amount}")
-            print(f"   Respuesta: {resp}")
+            LOG.info('order_placed', token=token_id, side=side, amount=amount, response=resp,
+                     warm_conn=warm, setup_saved_ms=round(saved_ms, 1), signal=signal)
         except Exception as e:
-            print(f"❌ Error ejecutando orden: {e}")
+            LOG.error('order_error', token=token_id, side=side, amount=amount, error=str(e), signal=signal)
 
 # ==================== MENÚ ====================
-def main_menu():
+def main_menu(profile_seconds=None):
     print("\n" + "="*90)
     print("🎯 POLYMARKET BTC 15m BOT - MONITOR + INFO EXTENDIDA")
     print("="*90)
     
+    LOG.start()
     trader = PolymarketTrader()
     
     # Auto-switch inicial si está habilitado
@@ -599,6 +1687,10 @@ def main_menu():
         print("\n🔄 Auto-switch habilitado")
         trader.auto_switch_to_next_market()
     
+    # --profile: entra directo al modo monitor perfilado (igual que la opción 11)
+    if profile_seconds:
+        trader.monitor_mode(profile_seconds=profile_seconds)
+    
     while True:
         # Verifica si debe cambiar de mercado
         if Config.AUTO_SWITCH_ENABLED and trader.should_switch_market():
@@ -623,6 +1715,9 @@ def main_menu():
         print("[6] Ver próximos mercados")
         print("[7] Forzar cambio de mercado")
         print("[8] MODO MONITOR (auto-refresh + MT4 signals)")
+        print(f"[9] Nivel de log (actual: {LOG.level_name()})")
+        print("[10] Ver posiciones y P&L")
+        print("[11] MODO MONITOR con profiling")
         print("[0] Salir")
         print("="*90)
         
@@ -641,6 +1736,8 @@ def main_menu():
                         trader.selected_market = m
                         try:
                             trader.selected_token_ids = json.loads(m.get('clobTokenIds', '[]'))
+                            trader.positions.register_market(m, trader.selected_token_ids, trader.market_end_ts(m))
+                            trader.resolver.add(m)
                             print("✅ Mercado seleccionado")
                         except:
                             print("⚠️ No se pudieron cargar tokens")
@@ -727,6 +1824,7 @@ def main_menu():
                 
                 if confirm == 's':
                     trader.place_market_order(token, amt, side)
+                    LOG.flush()
                 else:
                     print("❌ Orden cancelada")
                     
@@ -777,9 +1875,38 @@ def main_menu():
                 trader.trade_amount = 1.0
             trader.monitor_mode()
         
+        elif opt == "9":
+            stats = LOG.stats()
+            print(f"\n📝 Log de eventos: {LOG.path}")
+            print(f"   Eventos: {stats['emitted']} | Descartados: {stats['dropped']} | Pendientes: {stats['pending']}")
+            print(f"   Costo promedio por evento: {stats['avg_emit_us']} µs")
+            level = input("Nuevo nivel (DEBUG/INFO/WARN/ERROR, Enter para mantener): ").strip()
+            if level:
+                try:
+                    LOG.set_level(level)
+                    print(f"✅ Nivel configurado: {LOG.level_name()}")
+                except ValueError as e:
+                    print(f"❌ {e}")
+        
+        elif opt == "10":
+            trader.show_positions()
+        
+        elif opt == "11":
+            secs_str = input("\nSegundos a perfilar (Enter = 120): ").strip()
+            try:
+                secs = float(secs_str) if secs_str else 120.0
+            except ValueError:
+                print("❌ Valor inválido. Usando 120s.")
+                secs = 120.0
+            trader.monitor_mode(profile_seconds=secs)
+        
         elif opt == "0":
+            PROFILER.stop()
+            LOG.stop()
             print("\n" + "="*90)
             print("👋 ¡Hasta la próxima!")
+            for line in trader.conn.summary():
+                print(f"   {line}")
             print("="*90)
             break
         
@@ -788,5 +1915,12 @@ def main_menu():
 
 
 if __name__ == "__main__":
-    main_menu()
+    parser = argparse.ArgumentParser(description="Polymarket BTC 15m bot")
+    parser.add_argument("--profile", type=float, metavar="SEGUNDOS",
+                        help="Inicia el modo monitor perfilado durante SEGUNDOS (como la opción 11)")
+    parser.add_argument("--profile-dir", help=f"Carpeta de salida del profiling (default: {Config.PROFILE_DIR})")
+    args = parser.parse_args()
+    if args.profile_dir:
+        Config.PROFILE_DIR = args.profile_dir
+    main_menu(profile_seconds=args.profile)
 